@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from pyparsing import nestedExpr
+
+import kicad2unicode
+
+IC = '''(symbol "MCU:Foo"
+  (symbol "Foo_0_1" (rectangle (start -5.08 5.08) (end 5.08 -5.08))
+    (polyline (pts (xy -2.54 0) (xy 2.54 2.54)))
+    (circle (center 0 0) (radius 1.27)))
+  (symbol "Foo_1_1"
+    (pin input line (at -7.62 0 0) (length 2.54) (name "IN") (number "1"))
+    (pin output line (at 7.62 0 180) (length 2.54) (name "OUT") (number "2"))
+    (pin power_in line (at 0 7.62 270) (length 2.54) (name "~") (number "3"))
+    (pin power_in line (at 0 -7.62 90) (length 2.54) (name "GND") (number "4"))))'''
+
+def field(x, y, text):
+    return {"at": (x, y, 0.0), "text": text, "hidden": False}
+
+def symbol(lib_id, x, y, ref, val):
+    return {"kind": "symbol", "lib_id": lib_id, "at": (x, y, 0.0), "unit": 1, "mirror": '',
+            "reference": field(x + 2, y - 1, ref), "value": field(x + 2, y, val)}
+
+def synthetic_items(columns, rows):
+    sexpr = nestedExpr('(',')').parseString(IC).asList()[0]
+    yield {"kind": "lib_symbol", "lib_id": "MCU:Foo", "sexpr": kicad2unicode.unquote_sexpr(sexpr)}
+    k = 0
+    for gy in range(rows):
+        for gx in range(columns):
+            ox = 4 + gx * 30
+            oy = 4 + gy * 24
+            k += 1
+            yield symbol("Device:R", ox + 4, oy + 6, "R" + str(k), "10k")
+            yield symbol("Device:LED", ox + 4, oy + 14, "D" + str(k), "red")
+            yield symbol("power:GND", ox + 4, oy + 19, "#PWR" + str(k), "GND")
+            yield symbol("Device:C", ox + 12, oy + 10, "C" + str(k), "100n")
+            yield {"kind": "wire", "start": (ox + 4, oy + 9), "end": (ox + 4, oy + 11)}
+            yield {"kind": "wire", "start": (ox + 4, oy + 10), "end": (ox + 12, oy + 10)}
+            yield {"kind": "wire", "start": (ox, oy + 22), "end": (ox + 29, oy + 22)}
+            yield {"kind": "junction", "at": (ox + 4, oy + 10, 0.0)}
+            yield {"kind": "global_label", "name": "SIG" + str(k), "at": (ox + 14, oy + 4, 0.0)}
+            yield {"kind": "text", "at": (ox + 16, oy + 16, 0.0), "text": "note " + str(k)}
+            yield {"kind": "polyline", "start": (ox, oy + 21), "end": (ox + 26, oy + 21), "style": "dash"}
+            if gx % 3 == 1:
+                yield symbol("MCU:Foo", ox + 22, oy + 10, "U" + str(k), "FOO")
+
+def render_serial(scene, width, height):
+    fb = [[' '] * width for _ in range(height)]
+    kicad2unicode.draw_scene(fb, scene, True, True)
+    kicad2unicode.render(fb)
+
+def timed(render):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        render()
+    return time.perf_counter() - start, out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="time the band renderer (-j) on a synthetic sheet of repeated blocks")
+    parser.add_argument("-n", "--blocks", type=int, default=60, help="the sheet has n x n blocks of 30x24 cells")
+    parser.add_argument("-j", "--jobs", type=int, nargs='+', default=[2, 4, os.cpu_count()], help="process counts to compare with the serial renderer")
+    args = parser.parse_args()
+
+    width = 30 * args.blocks + 10
+    height = 24 * args.blocks + 10
+    scene = kicad2unicode.build_scene(synthetic_items(args.blocks, args.blocks), kicad2unicode.builtin_glyph_rules(), {}, 2/2.54)
+    print("sheet", width, "x", height, "cells,", os.cpu_count(), "cpus")
+
+    serial, expected = timed(lambda: render_serial(scene, width, height))
+    print("serial     %.2fs" % serial)
+    for jobs in sorted(set(args.jobs)):
+        t, output = timed(lambda: kicad2unicode.render_parallel(scene, width, height, jobs, True, True))
+        print("-j %-3d     %.2fs  x%.2f  %s" % (jobs, t, serial / t, "same" if output == expected else "DIFFERENT"))
+
+if __name__ == "__main__":
+    main()
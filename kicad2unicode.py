@@ -1,9 +1,24 @@
 #!/usr/bin/env python3
 from pyparsing import nestedExpr
 import argparse
-import copy
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import marshal
+import math
+import multiprocessing
+import os
 import re
 import pprint
+import sys
+import tempfile
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
 
 EMPTY = ((0,0),
     [
@@ -195,6 +210,10 @@ PWR = ((0,-1),
       ],
       (-1,1))
 
+GLYPH_CACHE_VERSION = 1
+STAMP_CACHE_VERSION = 3
+STAMP_CACHE_SIZE = 4096
+
 POLYLINE_BASE = 0x13000
 WIRE_BASE = 0x14000
 BASE_MASK = 0xff000
@@ -244,6 +263,9 @@ def draw_reference(fb, ref, offset = (0,0)):
 def draw_value(fb, val, offset = (0,0)):
     draw_reference(fb, val, offset)
 
+def device_value_offset(val):
+    return (-len(val[1])//2+1, 1)
+
 def draw_text(fb, t):
     pos = t[0]
     pos_x = int(pos[0] + 0.5)
@@ -340,67 +362,213 @@ def draw_junctions(fb, junctions):
         add_direction_to_metachar(fb, pos_x, pos_y, JUNC, WIRE_BASE)
 
 
+def pin_graphics(pin, lines, texts, warnings):
+    start = (pin[0][0], pin[0][1])
+    text_pos = start
+    name_pos = start
+    rotation = pin[0][2]
+    length = pin[1]-1
+    number = pin[2]
+    name = pin[3]
+    end = None
+    
+    
+    if rotation == 0:
+        start = (start[0]+1, start[1])
+        end = (start[0] + length, start[1])
+        name_pos = (name_pos[0] + 4, name_pos[1] + 1)
+    elif rotation == 90:
+        start = (start[0], start[1]-1)
+        end = (start[0], start[1] - length)
+        name_pos = (name_pos[0]-len(name)//2, name_pos[1] - 2)
+        text_pos = (text_pos[0]-1, text_pos[1])
+    elif rotation == 180:
+        start = (start[0]-1, start[1])
+        end = (start[0] - length, start[1])
+        name_pos = (name_pos[0] - len(name) - 3, name_pos[1] + 1)
+    elif rotation == 270:
+        start = (start[0], start[1]+1)
+        end = (start[0], start[1] + length)
+        name_pos = (name_pos[0]-len(name)//2, name_pos[1] + 4)
+        text_pos = (text_pos[0]-1, text_pos[1]+2)
+    else:
+        warnings.append("rotation of device pins not implemented!")
+        return
+    
+    lines.append((start, end))
+    texts.append((text_pos, None, number))
+    if name != '~':
+        texts.append((name_pos, None, name))
+
 def draw_device(fb, device):
-    pos, outlines, pins, name, ref, val = device
-    lines = []
+    pos, stamp, name, ref, val = device
+    metachars, chars, rows, warnings = stamp
     
-    for o in outlines:
-        
-        start = (o[0][0] + pos[0], o[0][1] + pos[1])
-        end = (o[1][0] + pos[0], o[1][1] + pos[1])
-        lines.append( ((start[0], start[1]), (start[0], end[1])) )
-        lines.append( ((start[0], end[1]), (end[0], end[1])) )
-        lines.append( ((end[0], end[1]), (end[0], start[1])) )
-        lines.append( ((end[0], start[1]), (start[0], start[1])) )
+    if val is not None:
+        draw_value(fb, val, device_value_offset(val))
     
-    draw_value(fb, val, (-len(val[1])//2+1,1))
+    for warning in warnings: #kept with the stamp, so cached stamps still report them
+        print(warning)
     
-    texts = []
+    for x, y, base, directions in metachars:
+        add_direction_to_metachar(fb, pos[0] + x, pos[1] + y, directions, base)
+    for x, y, c in chars:
+        fb[pos[1] + y][pos[0] + x] = c
+
+def draw_scene(fb, scene, draw_references, draw_values):
+    complex_devices, wires, junctions, devices, texts, lines = scene
     
-    for i in pins:
-        start = (i[0][0] + pos[0], i[0][1] + pos[1])
-        text_pos = start
-        name_pos = start
-        rotation = i[0][2]
-        length = i[1]-1
-        number = i[2]
-        name = i[3]
-        end = None
-        
-        
-        if rotation == 0:
-            start = (start[0]+1, start[1])
-            end = (start[0] + length, start[1])
-            name_pos = (name_pos[0] + 4, name_pos[1] + 1)
-        elif rotation == 90:
-            start = (start[0], start[1]-1)
-            end = (start[0], start[1] - length)
-            name_pos = (name_pos[0]-len(name)//2, name_pos[1] - 2)
-            text_pos = (text_pos[0]-1, text_pos[1])
-        elif rotation == 180:
-            start = (start[0]-1, start[1])
-            end = (start[0] - length, start[1])
-            name_pos = (name_pos[0] - len(name) - 3, name_pos[1] + 1)
-        elif rotation == 270:
-            start = (start[0], start[1]+1)
-            end = (start[0], start[1] + length)
-            name_pos = (name_pos[0]-len(name)//2, name_pos[1] + 4)
-            text_pos = (text_pos[0]-1, text_pos[1]+2)
-        else:
-            print("rotation of device pins not implemented!")
-            continue
-        
-        lines.append((start, end))
-        texts.append((text_pos, None, number))
-        if name != '~':
-            texts.append((name_pos, None, name))
+    for d in complex_devices:
+        draw_device(fb, d)
+    
+    draw_wires(fb, wires)
+    draw_junctions(fb, junctions)
+    
+    for d in devices:
+        draw_symbol(fb, d[1], d[0])
+        if len(d) > 2 and d[2] is not None and draw_references:
+            draw_reference(fb, d[2])
+            pass
+        if len(d) > 3 and d[3] is not None and draw_values:
+            offset = (0,0)
+            if len(d[1]) > 2:
+                offset = d[1][2]
+            draw_value(fb, d[3],offset)
     
-    draw_wires(fb, lines)
     for t in texts:
         draw_text(fb, t)
+    
+    draw_polylines(fb, lines)
 
 
+class OccupancyRow:
+    def __init__(self, cells, y, width):
+        self.cells = cells
+        self.y = y
+        self.width = width
+    
+    def __getitem__(self, x):
+        return ' '
+    
+    def __setitem__(self, x, c):
+        if c != ' ':
+            if x < 0:
+                x += self.width
+            self.cells.add((x, self.y))
+
+def symbol_box(symbol, pos):
+    if symbol is None or len(symbol[1]) == 0:
+        return None
+    w = len(symbol[1][0])
+    h = len(symbol[1])
+    return (int(pos[0] + 0.5) - w//2 + symbol[0][0], int(pos[1] + 0.5) - h//2 + symbol[0][1], w, h)
+
+def stamp_box(stamp, pos):
+    metachars, chars, rows, warnings = stamp
+    xs = [c[0] for c in metachars] + [c[0] for c in chars]
+    if not xs:
+        return None
+    return (pos[0] + min(xs), pos[1] + rows[0], max(xs) - min(xs) + 1, rows[1] - rows[0] + 1)
+
+def label_candidates(x, y, length, lines, box):
+    candidates = [(x, y), (x, y - 1), (x, y + 1)]
+    if box is not None:
+        x_start, y_start, w, h = box
+        middle = y_start + h//2
+        for dy in (0, -1, 1):
+            candidates.append((x_start + w + 1, middle + dy))
+            candidates.append((x_start - length - 1, middle + dy))
+        candidates.append((x_start + w//2 - length//2, y_start - lines))
+        candidates.append((x_start + w//2 - length//2, y_start + h))
+    candidates += [(x, y - 2), (x, y + 2)]
+    return candidates
+
+def label_fits(cells, labels, x, y, rows, width, height):
+    #only the cells left and right of a row are kept clear, labels may sit on adjacent rows
+    #like kicad's own reference/value pairs
+    if x < 0 or y < 0 or y + len(rows) > height:
+        return False
+    for dy, text in enumerate(rows):
+        if x + len(text) > width:
+            return False
+        for i in range(len(text)):
+            if (x + i, y + dy) in cells:
+                return False
+        if (x - 1, y + dy) in labels or (x + len(text), y + dy) in labels:
+            return False
+    return True
+
+def place_label(cells, labels, rows, x, y, box, width, height):
+    length = max(len(text) for text in rows)
+    spot = None
+    for cx, cy in label_candidates(x, y, length, len(rows), box):
+        if label_fits(cells, labels, cx, cy, rows, width, height):
+            spot = (cx, cy)
+            break
+    if spot is None:
+        print("could not place label", ' '.join(rows), "at", x, y)
+        spot = (x, y)
+    placed = []
+    for dy, text in enumerate(rows):
+        for i in range(len(text)):
+            cells.add((spot[0] + i, spot[1] + dy))
+            labels.add((spot[0] + i, spot[1] + dy))
+        placed.append( ((spot[0], spot[1] + dy + 1, 0.0), None, text) )
+    return placed
 
+def text_blocks(texts):
+    #lines of a multi line text follow each other and are moved together
+    blocks = []
+    for t in texts:
+        x = int(t[0][0] + 0.5)
+        y = int(t[0][1] + 0.5) - 1
+        if blocks and blocks[-1][0] == x and blocks[-1][1] + len(blocks[-1][2]) == y:
+            blocks[-1][2].append(t[2])
+        else:
+            blocks.append((x, y, [t[2]]))
+    return blocks
+
+def place_labels(scene, width, height, draw_references, draw_values):
+    complex_devices, wires, junctions, devices, texts, lines = scene
+    
+    bare_complex_devices = [(d[0], d[1], d[2], d[3], None) for d in complex_devices]
+    bare_devices = [(d[0], d[1], None, None) for d in devices]
+    
+    cells = set()
+    fb = [OccupancyRow(cells, y, width) for y in range(height)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        draw_scene(fb, (bare_complex_devices, wires, junctions, bare_devices, [], lines), False, False)
+    
+    labels = set()
+    placed = []
+    for x, y, rows in text_blocks(texts): #free texts first, they are placed on purpose
+        placed += place_label(cells, labels, rows, x, y, None, width, height)
+    
+    for d in complex_devices:
+        pos, stamp, name, ref, val = d
+        if val is None:
+            continue
+        offset = device_value_offset(val)
+        x = int(val[0][0] + 0.5) + offset[0]
+        y = int(val[0][1] + 0.5) + offset[1] - 1
+        placed += place_label(cells, labels, [val[1]], x, y, stamp_box(stamp, pos), width, height)
+    
+    for d in devices:
+        wanted = []
+        if len(d) > 2 and d[2] is not None and draw_references:
+            wanted.append((d[2], (0,0)))
+        if len(d) > 3 and d[3] is not None and draw_values:
+            offset = (0,0)
+            if len(d[1]) > 2:
+                offset = d[1][2]
+            wanted.append((d[3], offset))
+        
+        for label, offset in wanted:
+            x = int(label[0][0] + 0.5) + offset[0]
+            y = int(label[0][1] + 0.5) + offset[1] - 1
+            placed += place_label(cells, labels, [label[1]], x, y, symbol_box(d[1], d[0]), width, height)
+    
+    return (bare_complex_devices, wires, junctions, bare_devices, placed, lines)
 
 def select_polyline_piece(c):
     polyline_dashed_pieces = ['x', ' ', ' ', '╰', ' ', '╎', '╭', '├', ' ', '╯', '╌', '┴', '╮', '┤', '┬', '┼']
@@ -423,42 +591,160 @@ def select_polyline_piece(c):
         return polyline_solid_pieces[directions]
     
 
-def render(fb):
+def translate_cell(c):
     wire_endpieces =     ['x', '╽', '╾', '└', '╿', '│', '┌', '├', '╼', '┘', '─', '┴', '┐', '┤', '┬', '┼']
     junctions =          ['x', '╽', '╾', '└', '╿', '┃', '┏', '┣', '╼', '┛', '━', '┻', '┓', '┫', '┳', '╋']
     
-    fb_2 = copy.deepcopy(fb)
-    for y in range(len(fb)):
-        for x in range(len(fb[0])):
-            if ord(fb[y][x]) & BASE_MASK == POLYLINE_BASE:
-                fb_2[y][x] = select_polyline_piece(ord(fb[y][x]) & 0x1ff)
-            
-            elif ord(fb[y][x]) & BASE_MASK == WIRE_BASE:
-                if ord(fb[y][x]) & JUNC:
-                    fb_2[y][x] = junctions[ord(fb[y][x]) & 15]
-                else:
-                    fb_2[y][x] = wire_endpieces[ord(fb[y][x]) & 15]
-            elif ord(fb[y][x]) & BASE_MASK == (WIRE_BASE | POLYLINE_BASE):
-                fb_2[y][x] = select_polyline_piece(ord(fb[y][x]) & 0x1ff)
-    
+    code = ord(c)
+    if code & BASE_MASK == POLYLINE_BASE:
+        return select_polyline_piece(code & 0x1ff)
+    elif code & BASE_MASK == WIRE_BASE:
+        if code & JUNC:
+            return junctions[code & 15]
+        else:
+            return wire_endpieces[code & 15]
+    elif code & BASE_MASK == (WIRE_BASE | POLYLINE_BASE):
+        return select_polyline_piece(code & 0x1ff)
+    return c
+
+class PieceTable(dict):
+    def __missing__(self, code):
+        piece = translate_cell(chr(code))
+        if piece is None: #str.translate would drop the cell and shift the row
+            raise TypeError("no character for metachar " + hex(code))
+        self[code] = piece
+        return piece
+
+def translate_rows(fb):
+    pieces = PieceTable()
+    return [''.join(line).translate(pieces) for line in fb]
+
+def find_bounds(rows, y_offset = 0):
     start_x = 999999
     start_y = 999999
     end_x = 0
     end_y = 0
     
-    for y in range(len(fb_2)):
-        for x in range(len(fb_2[0])):
-            if fb_2[y][x] != ' ':
-                start_x = min(start_x, x)
-                start_y = min(start_y, y)
-                end_x = max(end_x, x)
-                end_y = max(end_y, y)
-    end_x += 1
-    end_y += 1
-    for y in range(start_y, end_y):
-        for x in range(start_x, end_x):
-            print(fb_2[y][x], end='')
-        print()
+    for y in range(len(rows)):
+        stripped = rows[y].rstrip(' ')
+        if stripped:
+            start_x = min(start_x, len(stripped) - len(stripped.lstrip(' ')))
+            start_y = min(start_y, y + y_offset)
+            end_x = max(end_x, len(stripped) - 1)
+            end_y = max(end_y, y + y_offset)
+    return (start_x, start_y, end_x, end_y)
+
+def merge_bounds(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def print_rows(rows, bounds):
+    start_x, start_y, end_x, end_y = bounds
+    for y in range(start_y, end_y + 1):
+        print(rows[y][start_x:end_x + 1])
+
+def render(fb):
+    rows = translate_rows(fb)
+    print_rows(rows, find_bounds(rows))
+
+
+def row_of(pos):
+    return int(pos[1] + 0.5)
+
+def line_span(l):
+    start = l[0]
+    end = l[1]
+    if start[0] != end[0] and start[1] != end[1]:
+        return (0, 0, True) #only prints an error
+    return (min(start[1], end[1]), max(start[1], end[1]), False)
+
+def symbol_span(d):
+    pos, symbol = d[0], d[1]
+    rows = []
+    if len(symbol[1]) > 0:
+        y_start = row_of(pos) - len(symbol[1])//2 + symbol[0][1]
+        rows += [y_start, y_start + len(symbol[1]) - 1]
+    if len(d) > 2 and d[2] is not None:
+        rows.append(row_of(d[2][0]) - 1)
+    if len(d) > 3 and d[3] is not None:
+        offset = (0,0)
+        if len(symbol) > 2:
+            offset = symbol[2]
+        rows.append(row_of(d[3][0]) + offset[1] - 1)
+    if not rows:
+        return (0, -1, False)
+    return (min(rows), max(rows), False)
+
+def device_span(device):
+    pos, stamp, name, ref, val = device
+    rows = []
+    if val is not None:
+        rows.append(row_of(val[0]))
+    if stamp[0] or stamp[1]:
+        rows += [pos[1] + stamp[2][0], pos[1] + stamp[2][1]]
+    if not rows:
+        return (0, -1, len(stamp[3]) > 0)
+    return (min(rows), max(rows), len(stamp[3]) > 0)
+
+def band_indices(span, height, band_height, bands):
+    lo, hi, noisy = span
+    if lo < 0 or hi >= height: #wraps around or fails like the serial renderer
+        return range(bands)
+    indices = list(range(lo // band_height, hi // band_height + 1))
+    if noisy and (not indices or indices[0] != 0):
+        indices.insert(0, 0) #band 0 keeps the error log
+    return indices
+
+def split_scene(scene, height, band_height, bands):
+    complex_devices, wires, junctions, devices, texts, lines = scene
+    band_scenes = [([], [], [], [], [], []) for _ in range(bands)]
+    kinds = (
+        (complex_devices, device_span),
+        (wires, line_span),
+        (junctions, lambda j: (row_of(j), row_of(j), False)),
+        (devices, symbol_span),
+        (texts, lambda t: (row_of(t[0]) - 1, row_of(t[0]) - 1, False)),
+        (lines, line_span),
+    )
+    for k, (items, span) in enumerate(kinds):
+        for item in items:
+            for b in band_indices(span(item), height, band_height, bands):
+                band_scenes[b][k].append(item)
+    return band_scenes
+
+def render_band(job):
+    band_scene, y0, y1, width, height, draw_references, draw_values = job
+    scratch = [' '] * width
+    fb = [scratch] * height #rows outside the band are thrown away
+    for y in range(y0, y1):
+        fb[y] = [' '] * width
+    
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        draw_scene(fb, band_scene, draw_references, draw_values)
+        rows = translate_rows(fb[y0:y1])
+    return rows, find_bounds(rows, y0), log.getvalue()
+
+def render_parallel(scene, width, height, jobs, draw_references, draw_values):
+    band_height = -(-height // jobs)
+    bands = -(-height // band_height)
+    band_scenes = split_scene(scene, height, band_height, bands)
+    
+    tasks = []
+    for b in range(bands):
+        y0 = b * band_height
+        y1 = min(height, y0 + band_height)
+        tasks.append((band_scenes[b], y0, y1, width, height, draw_references, draw_values))
+    
+    with multiprocessing.Pool(min(jobs, bands)) as pool:
+        results = pool.map(render_band, tasks)
+    
+    rows = []
+    bounds = (999999, 999999, 0, 0)
+    for band_rows, band_bounds, log in results:
+        rows += band_rows
+        bounds = merge_bounds(bounds, band_bounds)
+    print(results[0][2], end='')
+    print_rows(rows, bounds)
 
 def parse_position(line, norm):
     if line[0] == 'at':
@@ -469,39 +755,19 @@ def parse_position(line, norm):
             rot = float(line[3])
         return (x,y,rot)
 
-def parse_reference(line, norm):
-    for k in range(len(line)):
-        if line[k][0] == 'property':
-            if line[k][1] == '"Reference"':
-                for s in line[k]:
-                    if s == 'hide':
-                        return None
-                value = line[k][2].strip('"')
-                pos = parse_position(line[k][4], norm)
-                return (pos, value)
-
-def parse_value(line, norm):
+def parse_field(line, name, norm):
     for k in range(len(line)):
         if line[k][0] == 'property':
-            if line[k][1] == '"Value"':
-                for s in line[k]:
-                    if s == 'hide':
-                        return None
+            if line[k][1] == '"' + name + '"':
+                hidden = 'hide' in line[k]
                 value = line[k][2].strip('"')
                 pos = parse_position(line[k][4], norm)
-                return (pos, value)
+                return {"at": pos, "text": value, "hidden": hidden}
 
 def parse_line_coords(line, norm):
     result = (int(round(float(line[1]) * norm)), int(round(float(line[2]) * norm)) )
     return result
 
-def parse_rectangle(line, norm):
-    start = ( -int(round(float(line[1][1]) * norm)), -int(round(float(line[1][2]) * norm)) )
-    end = ( -int(round(float(line[2][1]) * norm )), -int(round(float(line[2][2]) * norm)) )
-    if start[0] > end[0]:
-        return (end, start)
-    return (start, end)
-
 def parse_pin(line, norm):
     pos = None
     length = None
@@ -520,43 +786,555 @@ def parse_pin(line, norm):
     return ((pos[0], -pos[1], pos[2]), length, number, name)
                 
 
-def lookup_outline(prop, norm):
-    outlines = []
-    for i in prop:
-        if type(i) is list:
-            if i[0] == 'rectangle':
-                outlines.append(parse_rectangle(i, norm))
-    return outlines
-                
+def lib_point(line, norm):
+    return (int(round(float(line[1]) * norm)), -int(round(float(line[2]) * norm)))
 
-def lookup_pins(prop, norm):
-    pins = []
-    for i in prop:
-        if type(i) is list:
-            if i[0] == 'pin' and 'hide' not in i:
-                pins.append(parse_pin(i, norm))
-    return pins
-
-def lookup_device(data, name, norm):
-    pins = []
-    outlines = []
-    for i in data[0]:
+def lib_point_exact(line, norm):
+    return (float(line[1]) * norm, -float(line[2]) * norm)
+
+def transform_point(p, rot, mirror):
+    x, y = p
+    for _ in range(int(round(rot / 90)) % 4):
+        x, y = y, -x
+    if mirror == 'x':
+        y = -y
+    elif mirror == 'y':
+        x = -x
+    return (x, y)
+
+def transform_pin(pin, rot, mirror):
+    directions = {(1,0): 0, (0,-1): 90, (-1,0): 180, (0,1): 270}
+    vectors = {0: (1,0), 90: (0,-1), 180: (-1,0), 270: (0,1)}
+    pos, length, number, name = pin
+    x, y = transform_point((pos[0], pos[1]), rot, mirror)
+    angle = pos[2]
+    if angle in vectors:
+        angle = directions[transform_point(vectors[angle], rot, mirror)]
+    return ((x, y, angle), length, number, name)
+
+def slanted_cells(start, end):
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    steps = max(abs(dx), abs(dy))
+    diagonal = '╲' if (dx > 0) == (dy > 0) else '╱'
+    straight = '─' if abs(dx) >= abs(dy) else '│'
+    if steps == 0: #degenerate arc or segment
+        return [(start[0], start[1], straight)]
+    cells = []
+    last = None
+    for i in range(steps + 1):
+        x = start[0] + int(round(dx * i / steps))
+        y = start[1] + int(round(dy * i / steps))
+        if last is not None and last[0] != x and last[1] != y:
+            cells.append((x, y, diagonal))
+        else:
+            cells.append((x, y, straight))
+        last = (x, y)
+    return cells
+
+def curve_cells(center, radius, start_angle, sweep):
+    if radius < 0.75:
+        return [(int(round(center[0])), int(round(center[1])), '○')]
+    steps = max(8, int(abs(sweep) * radius * 2) + 1)
+    cells = []
+    for i in range(steps + 1):
+        a = start_angle + sweep * i / steps
+        ca = math.cos(a)
+        sa = math.sin(a)
+        if abs(ca) > 0.92:
+            c = '│'
+        elif abs(sa) > 0.92:
+            c = '─'
+        elif sa < 0:
+            c = '╭' if ca < 0 else '╮'
+        else:
+            c = '╰' if ca < 0 else '╯'
+        cells.append((int(round(center[0] + radius * ca)), int(round(center[1] + radius * sa)), c))
+    return cells
+
+def arc_cells(start, mid, end):
+    ax, ay = start
+    bx, by = mid
+    cx, cy = end
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-9:
+        return slanted_cells((int(round(ax)), int(round(ay))), (int(round(cx)), int(round(cy))))
+    ux = ((ax*ax + ay*ay) * (by - cy) + (bx*bx + by*by) * (cy - ay) + (cx*cx + cy*cy) * (ay - by)) / d
+    uy = ((ax*ax + ay*ay) * (cx - bx) + (bx*bx + by*by) * (ax - cx) + (cx*cx + cy*cy) * (bx - ax)) / d
+    a_start = math.atan2(ay - uy, ax - ux)
+    a_mid = math.atan2(by - uy, bx - ux)
+    a_end = math.atan2(cy - uy, cx - ux)
+    sweep = (a_end - a_start) % (2 * math.pi)
+    if (a_mid - a_start) % (2 * math.pi) > sweep:
+        sweep -= 2 * math.pi
+    return curve_cells((ux, uy), math.hypot(ax - ux, ay - uy), a_start, sweep)
+
+def part_visible(part_name, unit):
+    fields = part_name.strip('"').split('_')
+    try:
+        part_unit = int(fields[-2])
+        convert = int(fields[-1])
+    except (IndexError, ValueError):
+        return True
+    return part_unit in (0, unit) and convert in (0, 1)
+
+def rasterize_lib_symbol(symbol, unit, rot, mirror, norm):
+    lines = []
+    cells = []
+    texts = []
+    warnings = []
+    
+    def point(p):
+        return transform_point(lib_point(p, norm), rot, mirror)
+    
+    def exact_point(p):
+        return transform_point(lib_point_exact(p, norm), rot, mirror)
+    
+    def segment(start, end):
+        if start[0] == end[0] or start[1] == end[1]:
+            lines.append((start, end))
+        else:
+            cells.extend(slanted_cells(start, end))
+    
+    for part in symbol:
+        if type(part) is not list or part[0] != 'symbol' or not part_visible(part[1], unit):
+            continue
+        for g in part:
+            if type(g) is not list:
+                continue
+            if g[0] == 'rectangle':
+                start = point(g[1])
+                end = point(g[2])
+                lines.append( ((start[0], start[1]), (start[0], end[1])) )
+                lines.append( ((start[0], end[1]), (end[0], end[1])) )
+                lines.append( ((end[0], end[1]), (end[0], start[1])) )
+                lines.append( ((end[0], start[1]), (start[0], start[1])) )
+            elif g[0] == 'polyline':
+                pts = [point(p) for p in g[1][1:] if p[0] == 'xy']
+                for k in range(len(pts) - 1):
+                    segment(pts[k], pts[k+1])
+            elif g[0] == 'circle':
+                center = exact_point(g[1])
+                radius = float(g[2][1]) * norm
+                cells.extend(curve_cells(center, radius, 0, 2 * math.pi))
+            elif g[0] == 'arc':
+                ends = {p[0]: p for p in g[1:] if type(p) is list}
+                if 'mid' in ends:
+                    cells.extend(arc_cells(exact_point(ends['start']), exact_point(ends['mid']), exact_point(ends['end'])))
+                else:
+                    segment(point(ends['start']), point(ends['end']))
+            elif g[0] == 'text':
+                effects = [e for e in g if type(e) is list and e[0] == 'effects']
+                if effects and 'hide' in effects[0]:
+                    continue
+                text = g[1].strip('"')
+                x, y = point(g[2])
+                texts.append( ((x - len(text)//2, y + 1), None, text) )
+            elif g[0] == 'pin' and 'hide' not in g:
+                pin_graphics(transform_pin(parse_pin(g, norm), rot, mirror), lines, texts, warnings)
+    
+    canvas = collections.defaultdict(lambda: collections.defaultdict(lambda: ' '))
+    draw_wires(canvas, lines)
+    for x, y, c in cells:
+        canvas[y][x] = c
+    for pos, _, text in texts:
+        for i, c in enumerate(text): #positions are relative, so no rounding like in draw_text
+            canvas[pos[1]-1][pos[0]+i] = c
+    
+    metachars = []
+    chars = []
+    for y in sorted(canvas):
+        for x in sorted(canvas[y]):
+            code = ord(canvas[y][x])
+            if canvas[y][x] == ' ':
+                continue
+            if code & BASE_MASK in (WIRE_BASE, POLYLINE_BASE, WIRE_BASE | POLYLINE_BASE):
+                metachars.append((x, y, code & BASE_MASK, code & 0x1ff))
+            else:
+                chars.append((x, y, canvas[y][x]))
+    
+    rows = (0, -1)
+    if canvas:
+        rows = (min(canvas), max(canvas))
+    return (metachars, chars, rows, warnings)
+
+def lookup_stamp(stamps, lib_symbols, lib_hashes, name, unit, rot, mirror, norm, cache_dir = None):
+    if name not in lib_symbols:
+        return ([], [], (0, -1), [])
+    if name not in lib_hashes:
+        lib_hashes[name] = hashlib.sha1(repr((norm, lib_symbols[name])).encode()).hexdigest()
+    key = (lib_hashes[name], unit, rot, mirror)
+    if key not in stamps:
+        stamp = None
+        if cache_dir is not None:
+            stamp = load_stamp(cache_dir, key)
+        if stamp is None:
+            stamp = rasterize_lib_symbol(lib_symbols[name], unit, rot, mirror, norm)
+            if cache_dir is not None:
+                save_stamp(cache_dir, key, stamp)
+        stamps[key] = stamp
+    return stamps[key]
+
+def stamp_cache_dir():
+    return cache_path('stamps.v' + str(STAMP_CACHE_VERSION))
+
+def stamp_path(cache_dir, key):
+    return os.path.join(cache_dir, hashlib.sha1(repr(key).encode()).hexdigest())
+
+def load_stamp(cache_dir, key):
+    path = stamp_path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            cached_key, stamp = marshal.load(f)
+        if cached_key == key:
+            os.utime(path) #keeps stamps in use from being pruned
+            return stamp
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    return None
+
+def save_stamp(cache_dir, key, stamp):
+    write_cache(stamp_path(cache_dir, key), (key, stamp))
+
+def prune_stamp_cache(cache_dir):
+    try:
+        entries = [(e.stat().st_mtime, e.path) for e in os.scandir(cache_dir) if not e.name.endswith('.tmp')]
+    except OSError:
+        return
+    entries.sort()
+    for mtime, path in entries[:max(0, len(entries) - STAMP_CACHE_SIZE)]: #oldest stamps go first
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def builtin_glyph_rules():
+    #(lib_id patterns, glyph, glyph when rotated by 270, draw reference)
+    return [
+        (['Device:R'], R, None, True),
+        (['Device:R_Small'], R_SMALL, None, True),
+        (['Device:R_Photo'], R_PHOTO, None, True),
+        (['Device:C'], C, None, True),
+        (['Device:C_Small'], C_SMALL, None, True),
+        (['Device:L'], L, None, True),
+        (['Device:L_Small'], L_SMALL, None, True),
+        (['Device:L_Ferrite'], L_FERRITE, None, True),
+        (['Device:LED'], LED, LED2, True),
+        (['power:GND'], GND, None, False),
+        (['power:.*'], PWR, None, False),
+        (['Diode:.*'], DIODE, DIODE2, True),
+        (['Transistor_BJT.*'], BJT, None, True),
+        (['Device:Q_NMOS.*'], NMOS, None, True),
+        (['Device:Q_PMOS.*'], PMOS, None, True),
+    ]
+
+def match_glyph_rule(rules, lib_id, matched):
+    if lib_id in matched:
+        return matched[lib_id]
+    result = None
+    for rule in rules:
+        if any(re.fullmatch(p, lib_id) for p in rule[0]):
+            result = rule
+            break
+    matched[lib_id] = result
+    return result
+
+def read_glyph_pack(filename):
+    try:
+        if filename.endswith('.toml'):
+            if tomllib is None:
+                print("error, reading toml glyph packs needs python 3.11 or newer")
+                return None
+            with open(filename, 'rb') as f:
+                pack = tomllib.load(f)
+        else:
+            with open(filename) as f:
+                pack = json.load(f)
+    except (OSError, ValueError) as e: #decode errors are ValueErrors
+        print("error, could not read glyph pack", filename, ":", e)
+        return None
+    if type(pack) is not dict or type(pack.get('glyphs', [])) is not list:
+        print("error, glyph pack", filename, "needs a list of glyphs under \"glyphs\"")
+        return None
+    return pack
+
+def is_offset(o):
+    return type(o) in (list, tuple) and len(o) == 2 and all(type(i) is int for i in o)
+
+def is_glyph_rows(rows):
+    if type(rows) is not list or len(rows) == 0:
+        return False
+    if not all(type(r) is str for r in rows):
+        return False
+    return all(len(r) == len(rows[0]) for r in rows)
+
+def compile_glyph(entry, filename):
+    if type(entry) is not dict:
+        print("error, glyph", repr(entry), "in", filename, "is not an object")
+        return None
+    name = entry.get('name', '?')
+    patterns = entry.get('lib_id')
+    if type(patterns) is str:
+        patterns = [patterns]
+    if type(patterns) is not list or not all(type(p) is str for p in patterns):
+        print("error, glyph", name, "in", filename, "has no lib_id pattern")
+        return None
+    for p in patterns:
+        try:
+            re.compile(p)
+        except re.error as e:
+            print("error, glyph", name, "in", filename, "has invalid lib_id pattern", p, ":", e)
+            return None
+    
+    anchor = entry.get('anchor', [0, 0])
+    value_offset = entry.get('value_offset')
+    if not is_offset(anchor) or (value_offset is not None and not is_offset(value_offset)):
+        print("error, glyph", name, "in", filename, "needs offsets as two integers")
+        return None
+    
+    glyphs = []
+    for key in ('rows', 'rows_270'):
+        rows = entry.get(key)
+        if rows is None and key == 'rows_270':
+            glyphs.append(None)
+            continue
+        if not is_glyph_rows(rows):
+            print("error, glyph", name, "in", filename, "needs", key, "as strings of equal length")
+            return None
+        if value_offset is None:
+            glyphs.append((tuple(anchor), rows))
+        else:
+            glyphs.append((tuple(anchor), rows, tuple(value_offset)))
+    
+    return (patterns, glyphs[0], glyphs[1], bool(entry.get('reference', True)))
+
+def cache_path(name):
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'kicad2unicode', name)
+
+def write_cache(path, data):
+    #written next to the target and renamed, so parallel runs never read a half written file
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(data, f)
+        os.replace(tmp, path)
+    except OSError:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+def glyph_cache_path(filename):
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return cache_path(key + '.glyphs')
+
+def load_glyph_pack(filename, use_cache = True):
+    try:
+        st = os.stat(filename)
+    except OSError as e:
+        print("error, could not read glyph pack", filename, ":", e)
+        return []
+    stamp = (GLYPH_CACHE_VERSION, st.st_mtime_ns, st.st_size)
+    cache = glyph_cache_path(filename)
+    
+    if use_cache:
+        try:
+            with open(cache, 'rb') as f:
+                cached_stamp, rules = marshal.load(f)
+            if cached_stamp == stamp:
+                return rules
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    
+    pack = read_glyph_pack(filename)
+    if pack is None:
+        return []
+    rules = []
+    for entry in pack.get('glyphs', []):
+        rule = compile_glyph(entry, filename)
+        if rule is not None:
+            rules.append(rule)
+    
+    #packs with errors are not cached, so the errors are reported on every run
+    if use_cache and len(rules) == len(pack.get('glyphs', [])):
+        write_cache(cache, (stamp, rules))
+    return rules
+
+FORM_TOKENS = re.compile(r'\\.|[()"]', re.S)
+
+def top_level_forms(f):
+    #yields the text of every form inside the root (kicad_sch ...) without reading the whole file
+    buf = ''
+    pos = 0
+    start = None
+    depth = 0
+    quoted = False
+    eof = False
+    while not eof:
+        chunk = f.read(1 << 16)
+        eof = chunk == ''
+        buf += chunk
+        last = pos
+        for m in FORM_TOKENS.finditer(buf, pos):
+            last = m.end()
+            c = m.group()
+            if c == '"':
+                quoted = not quoted
+            elif quoted or len(c) > 1:
+                continue
+            elif c == '(':
+                depth += 1
+                if depth == 2:
+                    start = m.start()
+            else:
+                depth -= 1
+                if depth == 1:
+                    yield buf[start:m.end()]
+                    start = None
+        pos = len(buf)
+        if buf.endswith('\\') and last < len(buf) and not eof:
+            pos -= 1 #escapes the first character of the next chunk
+        cut = pos if start is None else start
+        buf = buf[cut:]
+        pos -= cut
+        if start is not None:
+            start = 0
+
+def unquote_sexpr(sexpr):
+    return [unquote_sexpr(i) if type(i) is list else i.strip('"') for i in sexpr]
+
+def schematic_items(forms, norm):
+    parser = nestedExpr('(',')')
+    for form in forms:
+        i = parser.parseString(form).asList()[0]
+        
         if i[0] == 'lib_symbols':
             for symbol in i:
                 if symbol[0] == 'symbol':
-                    if symbol[1] == name:
-                        for prop in symbol:
-                            if type(prop) is list:
-                                if prop[0] == 'symbol':
-                                    new_outlines = lookup_outline(prop, norm)
-                                    for o in new_outlines:
-                                        outlines.append(o)
-                                    new_pins = lookup_pins(prop, norm)
-                                    for p in new_pins:
-                                        pins.append(p)
-    
-    return (outlines, pins)
-                                    
+                    yield {"kind": "lib_symbol", "lib_id": symbol[1].strip('"'), "sexpr": unquote_sexpr(symbol)}
+        
+        if i[0] == 'wire':
+            start = i[1][1]
+            end = i[1][2]
+            yield {"kind": "wire", "start": parse_line_coords(start, norm), "end": parse_line_coords(end, norm)}
+        
+        if i[0] == 'junction':
+            yield {"kind": "junction", "at": parse_position(i[1], norm)}
+        
+        if i[0] == 'polyline':
+            start = i[1][1]
+            end = i[1][2]
+            style = i[2][2][1]
+            yield {"kind": "polyline", "start": parse_line_coords(start, norm), "end": parse_line_coords(end, norm), "style": style}
+        
+        if i[0] == 'symbol' :
+            unit = 1
+            mirror = ''
+            for prop in i:
+                if type(prop) is list and prop[0] == 'unit':
+                    unit = int(prop[1])
+                if type(prop) is list and prop[0] == 'mirror':
+                    mirror = prop[1]
+            yield {
+                "kind": "symbol",
+                "lib_id": i[1][1].strip('"'),
+                "at": parse_position(i[2], norm),
+                "unit": unit,
+                "mirror": mirror,
+                "reference": parse_field(i, "Reference", norm),
+                "value": parse_field(i, "Value", norm),
+            }
+        
+        if i[0] == 'global_label' :
+            yield {"kind": "global_label", "name": i[1].strip('"'), "at": parse_position(i[3], norm)}
+        
+        if i[0] == 'text':
+            yield {"kind": "text", "at": parse_position(i[2], norm), "text": i[1].strip('"').replace('\\n', '\n')}
+
+def write_ir(items, out):
+    for item in items:
+        out.write(json.dumps(item, ensure_ascii=False))
+        out.write('\n')
+
+def read_ir(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def field_label(field):
+    if field is None or field["hidden"]:
+        return None
+    return (tuple(field["at"]), field["text"])
+
+def build_scene(items, glyph_rules, stamps, norm, cache_dir = None):
+    wires = []
+    junctions = []
+    devices = []
+    texts = []
+    lines = []
+    
+    complex_devices = []
+    
+    lib_symbols = {}
+    lib_hashes = {}
+    matched_rules = {}
+    
+    for item in items:
+        kind = item["kind"]
+        if kind == 'lib_symbol':
+            lib_symbols[item["lib_id"]] = item["sexpr"]
+        
+        if kind == 'wire':
+            wires.append((tuple(item["start"]), tuple(item["end"])))
+        
+        if kind == 'junction':
+            junctions.append(tuple(item["at"]))
+        
+        if kind == 'polyline':
+            lines.append( (tuple(item["start"]), tuple(item["end"]), item["style"]) )
+        
+        if kind == 'symbol':
+            pos = tuple(item["at"])
+            val = field_label(item["value"])
+            rule = match_glyph_rule(glyph_rules, item["lib_id"], matched_rules)
+            if rule is not None:
+                patterns, glyph, glyph_270, show_reference = rule
+                ref = None
+                if show_reference:
+                    ref = field_label(item["reference"])
+                if glyph_270 is not None and pos[2] == 270:
+                    glyph = glyph_270
+                devices.append( (pos, glyph, ref, val) )
+            else:
+                name = item["lib_id"]
+                stamp = lookup_stamp(stamps, lib_symbols, lib_hashes, name, item["unit"], pos[2], item["mirror"], norm, cache_dir)
+                complex_devices.append( (pos, stamp, name, None, val) )
+        
+        if kind == 'global_label':
+            pos = tuple(item["at"])
+            rot = pos[2]
+            name = item["name"]
+            LABEL = None
+            if rot == 180:
+                LABEL = ((-len(name)//2-1,0),[name + " ᐅ"])
+            if rot == 0:
+                LABEL = ((len(name)//2+2,0),["ᐊ " + name])
+            
+            devices.append( (pos, LABEL, None, None) )
+        
+        if kind == 'text':
+            pos = tuple(item["at"])
+            val = item["text"]
+            if '\n' in val:
+                vals = val.split('\n')
+                pos = (pos[0], pos[1] - len(vals)+1)
+                for n,v in enumerate(vals):
+                    texts.append( ((pos[0],pos[1] + n), None, v) )
+            else:
+                texts.append( (pos, None, val) )
+    
+    return (complex_devices, wires, junctions, devices, texts, lines)
 
 def init_argparse():
     parser = argparse.ArgumentParser(
@@ -572,12 +1350,27 @@ def init_argparse():
     parser.add_argument(
         "-b", "--box-transistors", action=argparse.BooleanOptionalAction, default=True, help="draw boxes around transistors (bjt/fet)"
     )
+    parser.add_argument(
+        "-p", "--place-labels", action=argparse.BooleanOptionalAction, default=False, help="move reference and value labels away from wires and other labels"
+    )
     parser.add_argument(
         "--width", type=int, default=190, help = "width of the framebuffer"
     )
     parser.add_argument(
         "--height", type=int, default=80, help = "height of the framebuffer"
     )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help = "render the sheet in horizontal bands on this many processes"
+    )
+    parser.add_argument(
+        "-g", "--glyph-pack", action="append", default=[], help = "json or toml file with extra glyphs, checked before the built in ones"
+    )
+    parser.add_argument(
+        "--glyph-cache", action=argparse.BooleanOptionalAction, default=True, help="keep compiled glyph packs and rasterized lib symbols in ~/.cache/kicad2unicode"
+    )
+    parser.add_argument(
+        "--emit-ir", choices=["jsonl"], help = "print the parsed schematic one item per line instead of rendering it, .jsonl files are read back as input"
+    )
     parser.add_argument('file', nargs=1)
 
     return parser
@@ -598,6 +1391,7 @@ def main():
     
     fb_width = args.width
     fb_heigth = args.height
+    jobs = args.jobs
     
     if not box_transistors:
         global NMOS
@@ -607,191 +1401,42 @@ def main():
         PMOS = PMOS2
         BJT = BJT2
     
-    data = ""
-
-    with open(filename) as f:
-        data = f.read()
-        
-    
     spacing = 2.54
     norm = 2/spacing
     
-    wires = []
-    junctions = []
-    devices = []
-    texts = []
-    lines = []
-    
-    complex_devices = []
-    
-    parsed = nestedExpr('(',')').parseString(data).asList()
-    for i in parsed[0]:
-        if i[0] == 'wire':
-            start = i[1][1]
-            end = i[1][2]
-            
-            start_coords = parse_line_coords(start, norm)
-            end_coords = parse_line_coords(end, norm)
-            wires.append((start_coords, end_coords))
+    with open(filename) as f:
+        if filename.endswith('.jsonl'):
+            items = read_ir(f)
+        else:
+            items = schematic_items(top_level_forms(f), norm)
         
-        if i[0] == 'junction':
-            pos = parse_position(i[1], norm)
-            junctions.append(pos)
+        if args.emit_ir == 'jsonl':
+            write_ir(items, sys.stdout)
+            return
         
-        if i[0] == 'polyline':
-            start = i[1][1]
-            end = i[1][2]
-            style = i[2][2][1]
-            
-            start_coords = parse_line_coords(start, norm)
-            end_coords = parse_line_coords(end, norm)
-            lines.append( (start_coords, end_coords, style) )
+        glyph_rules = []
+        for pack in args.glyph_pack:
+            glyph_rules += load_glyph_pack(pack, args.glyph_cache)
+        glyph_rules += builtin_glyph_rules()
         
-        if i[0] == 'symbol' :
-            if i[1][1] == '"Device:R"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, R, ref, val) )
-            elif i[1][1] == '"Device:R_Small"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, R_SMALL, ref, val) )
-            elif i[1][1] == '"Device:R_Photo"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, R_PHOTO, ref, val) )
-            elif i[1][1] == '"Device:C"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, C, ref, val) )
-            elif i[1][1] == '"Device:C_Small"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, C_SMALL, ref, val) )
-            elif i[1][1] == '"Device:L"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, L, ref, val) )
-            elif i[1][1] == '"Device:L_Small"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, L_SMALL, ref, val) )
-            elif i[1][1] == '"Device:L_Ferrite"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, L_FERRITE, ref, val) )
-            elif i[1][1] == '"Device:LED"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                if pos[2] == 270:
-                    devices.append( (pos, LED2, ref, val) )
-                else:
-                    devices.append( (pos, LED, ref, val) )
-            elif i[1][1] == '"power:GND"':
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                ref = None
-                val = parse_value(i, norm)
-                devices.append( (pos, GND, ref, val) )
-            elif re.match('"power:', i[1][1]):
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                ref = None
-                val = parse_value(i, norm)
-                devices.append( (pos, PWR, ref, val) )
-            elif re.match('"Diode:', i[1][1]):
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                if pos[2] == 270:
-                    devices.append( (pos, DIODE2, ref, val) )
-                else:
-                    devices.append( (pos, DIODE, ref, val) )
-            elif re.match('"Transistor_BJT', i[1][1]):
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, BJT, ref, val) )
-            elif re.match('"Device:Q_NMOS', i[1][1]):
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, NMOS, ref, val) )
-            elif re.match('"Device:Q_PMOS', i[1][1]):
-                pos = parse_position(i[2], norm)
-                ref = parse_reference(i, norm)
-                val = parse_value(i, norm)
-                devices.append( (pos, PMOS, ref, val) )
-            else:#re.match('"Connector', i[1][1]):
-                name = i[1][1]
-                pos = parse_position(i[2], norm)
-                ref = None
-                val = parse_value(i, norm)
-                outlines, pins = lookup_device(parsed,name, norm)
-                complex_devices.append( (pos, outlines, pins, name, ref, val) )
-            #else:
-            #    print("unknown symbol found:")
-            #    print(i)
+        cache_dir = None
+        if args.glyph_cache:
+            cache_dir = stamp_cache_dir()
         
-        if i[0] == 'global_label' :
-            pos = parse_position(i[3], norm)
-            rot = pos[2]
-            val = None
-            ref = None
-            name = i[1].strip('"')
-            LABEL = None
-            if rot == 180:
-                LABEL = ((-len(name)//2-1,0),[name + " ᐅ"])
-            if rot == 0:
-                LABEL = ((len(name)//2+2,0),["ᐊ " + name])
-            
-            devices.append( (pos, LABEL, ref, val) )
-            
-        if i[0] == 'text':
-            pos = parse_position(i[2], norm)
-            val = i[1].strip('"')
-            ref = None
-            if '\\n' in val:
-                vals = val.split('\\n')
-                pos = (pos[0], pos[1] - len(vals)+1)
-                for n,v in enumerate(vals):
-                    texts.append( ((pos[0],pos[1] + n), ref, v) )
-            else:
-                texts.append( (pos, ref, val) )
+        scene = build_scene(items, glyph_rules, {}, norm, cache_dir)
     
-    fb = [[' '] * fb_width for _ in range(fb_heigth)]
+    if cache_dir is not None:
+        prune_stamp_cache(cache_dir)
     
-    for d in complex_devices:
-        draw_device(fb, d)
-    
-    draw_wires(fb, wires)
-    draw_junctions(fb, junctions)
+    if args.place_labels:
+        scene = place_labels(scene, fb_width, fb_heigth, draw_references, draw_values)
     
-    for d in devices:
-        draw_symbol(fb, d[1], d[0])
-        if len(d) > 2 and d[2] is not None and draw_references:
-            draw_reference(fb, d[2])
-            pass
-        if len(d) > 3 and d[3] is not None and draw_values:
-            offset = (0,0)
-            if len(d[1]) > 2:
-                offset = d[1][2]
-            draw_value(fb, d[3],offset)
-    
-    for t in texts:
-        draw_text(fb, t)
-    
-    draw_polylines(fb, lines)
+    if jobs > 1:
+        render_parallel(scene, fb_width, fb_heigth, jobs, draw_references, draw_values)
+        return
     
+    fb = [[' '] * fb_width for _ in range(fb_heigth)]
+    draw_scene(fb, scene, draw_references, draw_values)
     render(fb)
 
 if __name__ == "__main__":